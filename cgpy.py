@@ -1,11 +1,13 @@
 import pygame
 from pygame import gfxdraw
-from math import sin, ceil, floor, pi, cos
+from math import sin, floor, pi, cos, log2
 import numpy as np
 import time
 from PIL import Image
 import random
 import os
+from collections import OrderedDict
+from functools import lru_cache
 
 cg_dir = os.getcwd()
 
@@ -62,109 +64,859 @@ class Color:
 
 
 class Polygon:
+    # Vertex positions live in one (N, 2) float array and the per-vertex
+    # attributes (texture coordinates, or RGBA for color gradients) in a
+    # parallel (N, k) array. The list of points is only rebuilt on demand.
+    __slots__ = (
+        "positions",
+        "attributes",
+        "color_attributes",
+        "_points",
+        "_bounds",
+        "_center",
+    )
+
     def __init__(self, points):
         self.points = points
 
+    @classmethod
+    def from_arrays(cls, positions, attributes, color_attributes=False):
+        polygon = cls.__new__(cls)
+
+        polygon.positions = positions
+        polygon.attributes = attributes
+        polygon.color_attributes = color_attributes
+        polygon.invalidate()
+
+        return polygon
+
+    @property
+    def points(self):
+        # Read only tuples: editing a point in place would leave the arrays and
+        # cached bounds behind, so changes go through the setter instead
+        if self._points is None:
+            if self.color_attributes:
+                attributes = [(Color(row),) for row in self.attributes.tolist()]
+            else:
+                attributes = [tuple(row) for row in self.attributes.tolist()]
+
+            self._points = tuple(
+                tuple(xy) + extra
+                for xy, extra in zip(self.positions.tolist(), attributes)
+            )
+
+        return self._points
+
+    @points.setter
+    def points(self, points):
+        self.color_attributes = (
+            len(points) > 0 and len(points[0]) > 2 and isinstance(points[0][2], Color)
+        )
+
+        self.positions = np.array(
+            [point[:2] for point in points], dtype=float
+        ).reshape(-1, 2)
+
+        if self.color_attributes:
+            self.attributes = np.array([point[2].get_color() for point in points])
+        elif points:
+            self.attributes = np.array(
+                [point[2:] for point in points], dtype=float
+            ).reshape(len(points), -1)
+        else:
+            self.attributes = np.zeros((0, 0))
+
+        self.invalidate()
+
+    def invalidate(self):
+        self._points = None
+        self._bounds = None
+        self._center = None
+
     def insert_points(self, points):
-        self.points += points
+        self.points = list(self.points) + list(points)
 
     def update_point(self, pos, point):
-        self.points[pos] = point
+        points = list(self.points)
+        points[pos] = point
+
+        self.points = points
 
     def y_min(self):
-        return min(int(row[1]) for row in self.points)
+        return int(self.get_rectangle_bounds()[1])
 
     def y_max(self):
-        return max(int(row[1]) for row in self.points)
+        return int(self.get_rectangle_bounds()[3])
 
     def center(self):
-        x_sum = sum(row[0] for row in self.points)
-        y_sum = sum(row[1] for row in self.points)
-        num_points = len(self.points)
+        if self._center is None:
+            num_points = len(self.positions)
+            x_sum, y_sum = self.positions.sum(axis=0).tolist()
 
-        center_x = int(x_sum / num_points)
-        center_y = int(y_sum / num_points)
+            center_x = int(x_sum / num_points)
+            center_y = int(y_sum / num_points)
 
-        return center_x, center_y
+            self._center = (center_x, center_y)
+
+        return self._center
 
     def get_rectangle_bounds(self):
-        x_coords = [point[0] for point in self.points]
-        y_coords = [point[1] for point in self.points]
+        if self._bounds is None:
+            x1, y1 = self.positions.min(axis=0).tolist()
+            x2, y2 = self.positions.max(axis=0).tolist()
 
-        x1 = min(x_coords)
-        y1 = min(y_coords)
-        x2 = max(x_coords)
-        y2 = max(y_coords)
+            self._bounds = (x1, y1, x2, y2)
 
-        return x1, y1, x2, y2
+        return self._bounds
 
+    def overlaps(self, polygon, motion=(0, 0)):
+        # Separating axis test for convex polygons: they are apart only if
+        # their projections on some edge normal of either one don't meet.
+        # Touching polygons overlap, like touching bounding boxes do.
+        #
+        # With a motion, polygon is swept back along it: on every axis its
+        # projection slides, meeting this one's over a range of times, and
+        # they hit if those ranges share a time within the step.
+        axes = np.vstack((self.edge_normals(), polygon.edge_normals()))
 
-class TexturePolygon:
-    def __init__(self, points=[]):
-        self.points = points
+        # Sweeping adds the sides along the motion, with their own normal
+        if motion[0] or motion[1]:
+            axes = np.vstack((axes, (-motion[1], motion[0])))
 
-    def insert_points(self, points):
-        self.points += points
+        a = self.positions @ axes.T
+        b = polygon.positions @ axes.T
 
-    def y_min(self):
-        return min(int(row[1]) for row in self.points)
+        a_min, a_max = a.min(axis=0), a.max(axis=0)
+        b_min, b_max = b.min(axis=0), b.max(axis=0)
 
-    def y_max(self):
-        return max(int(row[1]) for row in self.points)
+        speed = axes @ motion
 
-    def center(self):
-        x_sum = sum(row[0] for row in self.points)
-        y_sum = sum(row[1] for row in self.points)
-        num_points = len(self.points)
+        if not speed.any():
+            return not ((a_max < b_min) | (b_max < a_min)).any()
+
+        # Times in [-1, 0], from the start of the step to now, where the
+        # projections meet. Still axes either always or never meet.
+        moving = speed != 0
+        safe_speed = np.where(moving, speed, 1)
+
+        enter = (a_min - b_max) / safe_speed
+        leave = (a_max - b_min) / safe_speed
+
+        enter, leave = np.minimum(enter, leave), np.maximum(enter, leave)
+
+        still_apart = ~moving & ((a_max < b_min) | (b_max < a_min))
+
+        first = max(enter[moving].max(initial=-1), -1)
+        last = min(leave[moving].min(initial=0), 0)
+
+        return first <= last and not still_apart.any()
+
+    def edge_normals(self):
+        edges = np.roll(self.positions, -1, axis=0) - self.positions
+
+        return np.column_stack((edges[:, 1], -edges[:, 0]))
 
-        center_x = int(x_sum / num_points)
-        center_y = int(y_sum / num_points)
 
-        return center_x, center_y
+class TexturePolygon(Polygon):
+    __slots__ = ()
+
+    def __init__(self, points=[]):
+        self.points = points
+
+    def check_collision(self, rectangle, motion=(0, 0)):
+        # motion is how far rectangle moved relative to this polygon over the
+        # last step, ending where it is now. Both tests sweep it along it.
+        mx, my = motion
 
-    def check_collision(self, rectangle):
         rect1_x1, rect1_y1, rect1_x2, rect1_y2 = self.get_rectangle_bounds()
         rect2_x1, rect2_y1, rect2_x2, rect2_y2 = rectangle.get_rectangle_bounds()
 
-        # print(self.points)
-        # print(rect1_x1, rect1_y1, rect1_x2, rect1_y2)
-
+        # Bounding boxes, grown to cover the whole step, reject most pairs.
+        # The ones left are tested exactly, which matters once a polygon has
+        # been rotated.
         return (
-            rect1_x1 <= rect2_x2
-            and rect1_x2 >= rect2_x1
-            and rect1_y1 <= rect2_y2
-            and rect1_y2 >= rect2_y1
+            rect1_x1 <= rect2_x2 - min(mx, 0)
+            and rect1_x2 >= rect2_x1 - max(mx, 0)
+            and rect1_y1 <= rect2_y2 - min(my, 0)
+            and rect1_y2 >= rect2_y1 - max(my, 0)
+            and self.overlaps(rectangle, motion)
         )
 
-    def get_rectangle_bounds(self):
-        x_coords = [point[0] for point in self.points]
-        y_coords = [point[1] for point in self.points]
 
-        x1 = min(x_coords)
-        y1 = min(y_coords)
-        x2 = max(x_coords)
-        y2 = max(y_coords)
+@lru_cache(maxsize=64)
+def rotation(ang):
+    # (cos, sin) of an angle in degrees, kept for the angles used repeatedly
+    ang = (ang * pi) / 180
+
+    return cos(ang), sin(ang)
+
+
+class Affine:
+    # 2x3 affine transform [[a, b, c], [d, e, f]] stored as plain floats.
+    # translate/scale/rotate compose in place (the new step is applied after
+    # the current ones, like compose_*), so chaining them allocates nothing.
+    __slots__ = ("a", "b", "c", "d", "e", "f")
+
+    def __init__(self, a=1.0, b=0.0, c=0.0, d=0.0, e=1.0, f=0.0):
+        self.a = a
+        self.b = b
+        self.c = c
+        self.d = d
+        self.e = e
+        self.f = f
+
+    def copy(self):
+        return Affine(self.a, self.b, self.c, self.d, self.e, self.f)
+
+    def translate(self, tx, ty):
+        self.c += tx
+        self.f += ty
+
+        return self
+
+    def scale(self, sx, sy):
+        self.a *= sx
+        self.b *= sx
+        self.c *= sx
+        self.d *= sy
+        self.e *= sy
+        self.f *= sy
+
+        return self
+
+    def rotate(self, ang):
+        cos_ang, sin_ang = rotation(ang)
+
+        a, b, c = self.a, self.b, self.c
+        d, e, f = self.d, self.e, self.f
+
+        self.a = cos_ang * a - sin_ang * d
+        self.b = cos_ang * b - sin_ang * e
+        self.c = cos_ang * c - sin_ang * f
+        self.d = sin_ang * a + cos_ang * d
+        self.e = sin_ang * b + cos_ang * e
+        self.f = sin_ang * c + cos_ang * f
+
+        return self
+
+    def then(self, other):
+        # Applies other after this transform
+        a, b, c = self.a, self.b, self.c
+        d, e, f = self.d, self.e, self.f
+
+        self.a = other.a * a + other.b * d
+        self.b = other.a * b + other.b * e
+        self.c = other.a * c + other.b * f + other.c
+        self.d = other.d * a + other.e * d
+        self.e = other.d * b + other.e * e
+        self.f = other.d * c + other.e * f + other.f
+
+        return self
+
+    def is_translation(self):
+        return self.a == 1 and self.b == 0 and self.d == 0 and self.e == 1
+
+    @property
+    def matrix(self):
+        return np.array(
+            [
+                [self.a, self.b, self.c],
+                [self.d, self.e, self.f],
+                [0, 0, 1],
+            ]
+        )
+
+    def apply(self, positions):
+        # Pure translations only offset the vertices
+        if self.is_translation():
+            return positions + (self.c, self.f)
+
+        return positions @ np.array([[self.a, self.d], [self.b, self.e]]) + (
+            self.c,
+            self.f,
+        )
+
+
+def window_to_viewport(window, viewport):
+    # A new Affine every call, so callers may compose onto it freely
+    return Affine(*window_to_viewport_coefficients(window, viewport))
+
+
+@lru_cache(maxsize=64)
+def window_to_viewport_coefficients(window, viewport):
+    xi, yi, xf, yf = window
+    xiv, yiv, xfv, yfv = viewport
+
+    a = (xfv - xiv) / (xf - xi)
+    b = (yfv - yiv) / (yf - yi)
+
+    return (a, 0, xiv - a * xi, 0, b, yiv - b * yi)
+
+
+class Edge:
+    __slots__ = (
+        "y_start",
+        "y_end",
+        "x",
+        "attributes",
+        "_x0",
+        "_y0",
+        "_dx",
+        "_a0",
+        "_da",
+    )
+
+    def __init__(self, pi, pf, ai, af, y_start, y_end):
+        dy = pf[1] - pi[1]
+
+        self.y_start = y_start
+        self.y_end = y_end
+
+        # Slopes are computed once per edge. Each step evaluates the edge from
+        # its top vertex instead of accumulating += dx, so rows that land
+        # exactly on a vertex don't drift off by one pixel.
+        self._x0 = pi[0]
+        self._y0 = pi[1]
+        self._dx = (pf[0] - pi[0]) / dy
+        self._a0 = ai
+        self._da = [(b - a) / dy for a, b in zip(ai, af)]
+
+        self.move_to(y_start)
+
+    def move_to(self, y):
+        k = y - self._y0
+
+        self.x = self._x0 + k * self._dx
+        self.attributes = [a + k * da for a, da in zip(self._a0, self._da)]
+
+
+class SolidSpanShader:
+    def __init__(self, color):
+        self.color = color
+
+    def attributes(self, polygon):
+        return [()] * len(polygon.positions)
+
+    def shade(self, game, y, x1, x2, a1, a2):
+        game.fill_span(y, int(x1), int(x2), self.color)
+
 
-        return x1, y1, x2, y2
+class GradientSpanShader:
+    def attributes(self, polygon):
+        return polygon.attributes.tolist()
+
+    def shade(self, game, y, x1, x2, a1, a2):
+        x1 = int(x1)
+        x2 = int(x2)
+
+        if x1 == x2:
+            return
+
+        # Only the part of the span inside the clip rect is interpolated
+        start = max(x1, game.clip.left)
+        end = min(x2, game.clip.right - 1)
+
+        if start > end:
+            return
+
+        # Edge colors are truncated like Color.sub_color_gradient does, then
+        # the whole span is interpolated as one (n, 4) RGBA block
+        c1 = np.array(a1, dtype=int)
+        c2 = np.array(a2, dtype=int)
+
+        p = np.arange(start - x1, end - x1 + 1) / (x2 - x1)
+
+        colors = ((c2 - c1) * p[:, None] + c1).astype(np.uint8)
+
+        game.write_span(y, start, colors)
+
+
+class TextureSpanShader:
+    def __init__(self, texture):
+        self.texture = texture
+
+        num_rows, num_cols = texture.shape[:2]
+
+        self.max_row = num_rows - 1
+        self.max_col = num_cols - 1
+
+    def attributes(self, polygon):
+        return polygon.attributes[:, :2].tolist()
+
+    def shade(self, game, y, x1, x2, a1, a2):
+        if x1 == x2:
+            return
+
+        xs = np.arange(
+            max(int(x1), game.clip.left), min(int(x2), game.clip.right - 1) + 1
+        )
+
+        if not len(xs):
+            return
+
+        pc = (xs - x1) / (x2 - x1)
+
+        tx = a1[0] + pc * (a2[0] - a1[0])
+        ty = a1[1] + pc * (a2[1] - a1[1])
+
+        # Same clamping and truncation as get_pixel_with_texture, for a whole
+        # span of texels gathered at once
+        cols = (np.clip(tx, 0, 1) * self.max_col).astype(int)
+        rows = (np.clip(ty, 0, 1) * self.max_row).astype(int)
+
+        game.write_span(y, xs[0], self.texture[rows, cols])
+
+
+class Texture:
+    def __init__(self, image):
+        # Mip chain built once: every level halves the previous one with a
+        # 2x2 box filter, down to a single texel row or column
+        self.levels = [image]
+
+        while min(image.shape[:2]) > 1:
+            rows = image.shape[0] // 2
+            cols = image.shape[1] // 2
+
+            image = image[: rows * 2, : cols * 2].reshape(rows, 2, cols, 2, -1)
+            image = image.mean(axis=(1, 3)).astype(np.uint8)
+
+            self.levels.append(image)
+
+        for level in self.levels:
+            level.setflags(write=False)
+
+        self.nbytes = sum(level.nbytes for level in self.levels)
+
+    @property
+    def shape(self):
+        return self.levels[0].shape
+
+    def select_level(self, polygon):
+        x1, y1, x2, y2 = polygon.get_rectangle_bounds()
+        du, dv = np.ptp(polygon.attributes[:, :2], axis=0).tolist()
+
+        num_rows, num_cols = self.shape[:2]
+
+        # Texels covered by one screen pixel along each axis
+        density = max(
+            du * num_cols / max(x2 - x1, 1),
+            dv * num_rows / max(y2 - y1, 1),
+        )
+
+        if density <= 1:
+            return self.levels[0]
+
+        return self.levels[min(int(log2(density)), len(self.levels) - 1)]
+
+
+class TextureRegistry:
+    def __init__(self, directory, budget=64 * 1024 * 1024):
+        self.directory = directory
+        self.budget = budget
+        self.size = 0
+
+        # Decoded textures in least recently used order
+        self.textures = OrderedDict()
+
+        # The resource tree is scanned once, textures are named by their path
+        # relative to the directory ("enemys_textures/yuri.jpg")
+        self.paths = {}
+
+        for root, _, files in os.walk(directory):
+            for file in sorted(files):
+                path = os.path.join(root, file)
+                name = os.path.relpath(path, directory).replace(os.sep, "/")
+
+                self.paths[name] = path
+
+    def names(self, folder=""):
+        return [
+            name
+            for name in self.paths
+            if os.path.dirname(name) == folder.strip("/")
+        ]
+
+    def get(self, name):
+        if name in self.textures:
+            self.textures.move_to_end(name)
+            return self.textures[name]
+
+        # A single read-only texture is shared by every polygon using it
+        texture = Texture(np.array(Image.open(self.paths[name])))
+
+        self.textures[name] = texture
+        self.size += texture.nbytes
+
+        self.evict()
+
+        return texture
+
+    def preload(self, folder=""):
+        for name in self.names(folder):
+            self.get(name)
+
+    def evict(self):
+        # The most recently used texture is always kept, even over budget
+        while self.size > self.budget and len(self.textures) > 1:
+            _, texture = self.textures.popitem(last=False)
+            self.size -= texture.nbytes
+
+
+@lru_cache(maxsize=64)
+def circumference_offsets(r):
+    # Midpoint circle points around (0, 0), computed once per radius
+    points = []
+
+    x = 0
+    y = r
+
+    sectors = [(1, 1), (-1, 1), (1, -1), (-1, -1)]
+
+    p = 3 - 2 * r
+
+    while y >= x:
+        for x_signal, y_signal in sectors:
+            points.append((x_signal * x, y_signal * y))
+            points.append((x_signal * y, y_signal * x))
+
+        x += 1
+
+        if p > 0:
+            y -= 1
+            p += 4 * (x - y) + 10
+        else:
+            p += 4 * x + 6
+
+    return offsets_to_arrays(points)
+
+
+@lru_cache(maxsize=64)
+def ellipse_offsets(rx, ry):
+    # Midpoint ellipse points around (0, 0), computed once per radii pair
+    points = []
+
+    x = 0
+    y = abs(ry)
+
+    sectors = [(1, 1), (-1, 1), (1, -1), (-1, -1)]
+
+    rx_squared = rx**2
+    ry_squared = ry**2
+
+    px = 0
+    py = 2 * rx_squared * y
+
+    p = ry_squared - (rx_squared * ry) + (0.25 * rx_squared)
+
+    while px <= py:
+        for x_signal, y_signal in sectors:
+            points.append((x_signal * x, y_signal * y))
+
+        x += 1
+        px += 2 * ry_squared
+
+        if p < 0:
+            p += ry_squared + px
+        else:
+            y -= 1
+            py -= 2 * rx_squared
+            p += ry_squared + px - py
+
+    p = (
+        ry_squared * (x + 0.5) ** 2
+        + rx_squared * (y - 1) ** 2
+        - rx_squared * ry_squared
+    )
+
+    while y >= 0:
+        for x_signal, y_signal in sectors:
+            points.append((x_signal * x, y_signal * y))
+
+        y -= 1
+        py -= 2 * rx_squared
+
+        if p > 0:
+            p += rx_squared - py
+        else:
+            x += 1
+            px += 2 * ry_squared
+            p += rx_squared - py + px
+
+    return offsets_to_arrays(points)
+
+
+@lru_cache(maxsize=64)
+def circumference_spans(r):
+    return offsets_to_spans(*circumference_offsets(r))
+
+
+@lru_cache(maxsize=64)
+def ellipse_spans(rx, ry):
+    return offsets_to_spans(*ellipse_offsets(rx, ry))
+
+
+def offsets_to_arrays(points):
+    dx, dy = np.array(points, dtype=int).T
+
+    dx.setflags(write=False)
+    dy.setflags(write=False)
+
+    return dx, dy
+
+
+def offsets_to_spans(dx, dy):
+    # One horizontal span per outline row, reaching its outermost point, which
+    # is what a flood fill of the outline's inside would cover
+    dys = np.unique(dy)
+
+    half_widths = np.zeros(len(dys), dtype=int)
+    np.maximum.at(half_widths, np.searchsorted(dys, dy), np.abs(dx))
+
+    return dys.tolist(), half_widths.tolist()
+
+
+def init_headless():
+    # SDL only reads SDL_VIDEODRIVER when pygame.init() starts the display, so
+    # the dummy driver is set around that call alone. A driver picked by the
+    # user is kept, and the environment is left as it was.
+    driver = os.environ.get("SDL_VIDEODRIVER")
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+    try:
+        pygame.init()
+    finally:
+        if driver is None:
+            del os.environ["SDL_VIDEODRIVER"]
+
+
+def merge_rects(rects, tile=32, limit=64):
+    # Merges overlapping pygame rects, so no region is handled twice. Pairwise
+    # merging is quadratic, so past limit rects they are first snapped to a
+    # grid of tile sized cells, and the runs of touched cells along each row
+    # are merged instead. Their number is bounded by the grid, not the rects.
+    if len(rects) > limit:
+        rects = tile_rects(rects, tile)
+
+    merged = []
+
+    for rect in rects:
+        i = rect.collidelist(merged)
+
+        while i != -1:
+            rect = rect.union(merged.pop(i))
+            i = rect.collidelist(merged)
+
+        merged.append(rect)
+
+    return merged
+
+
+def tile_rects(rects, tile):
+    cells = set()
+
+    for rect in rects:
+        for cy in range(rect.top // tile, (rect.bottom - 1) // tile + 1):
+            for cx in range(rect.left // tile, (rect.right - 1) // tile + 1):
+                cells.add((cy, cx))
+
+    runs = []
+
+    for cy, cx in sorted(cells):
+        run = runs[-1] if runs else None
+
+        if run and run.top == cy * tile and run.right == cx * tile:
+            run.w += tile
+        else:
+            runs.append(pygame.Rect(cx * tile, cy * tile, tile, tile))
+
+    return runs
+
+
+def outcodes(xs, ys, bounds):
+    # Cohen-Sutherland region codes of points against the x1 <= x <= x2,
+    # y1 <= y <= y2 box: left 1, right 2, top 4, bottom 8
+    x1, y1, x2, y2 = bounds
+
+    return (xs < x1) * 1 | (xs > x2) * 2 | (ys < y1) * 4 | (ys > y2) * 8
+
+
+def clip_steps(start, step, lower, upper, first, last):
+    # Liang-Barsky on a parametric run of points start + i * step, narrowing
+    # every [first, last] range of i to the steps between lower and upper
+    moving = step != 0
+    safe_step = np.where(moving, step, 1)
+
+    enter = (lower - start) / safe_step
+    leave = (upper - start) / safe_step
+
+    enter, leave = np.where(step < 0, leave, enter), np.where(step < 0, enter, leave)
+
+    outside = ~moving & ((start < lower) | (start > upper))
+
+    first = np.where(moving, np.maximum(first, enter), first)
+    last = np.where(moving, np.minimum(last, leave), last)
+    last = np.where(outside, first - 1, last)
+
+    return first, last
 
 
 class Game:
-    def __init__(self, height, width, caption="Trabalho CG"):
+    def __init__(
+        self,
+        height,
+        width,
+        caption="Trabalho CG",
+        framebuffer=False,
+        headless=False,
+        on_update=None,
+    ):
         self.height = height
         self.width = width
 
-        pygame.init()
+        # Headless games render to an in-memory surface. SDL still needs a
+        # video driver for the event queue, so the dummy one is used instead
+        # of opening a window.
+        self.headless = headless
+        self.on_update = on_update
+        self.frames = 0
+
+        if headless and not pygame.display.get_init():
+            init_headless()
+        else:
+            # An already initialized display keeps its driver, a headless game
+            # then just never presents to it
+            pygame.init()
+
         pygame.display.set_caption(caption)
 
-        self.surface = pygame.display.set_mode((width, height))
+        if headless:
+            self.surface = pygame.Surface((width, height))
+        else:
+            self.surface = pygame.display.set_mode((width, height))
+
         self.surface.fill((0, 0, 0))
 
+        # Regions drawn since the last update. Only those are presented, unless
+        # they cover more than dirty_threshold of the screen, where a single
+        # full update is cheaper than many small ones.
+        self.dirty = [pygame.Rect(0, 0, width, height)]
+        self.dirty_threshold = 0.5
+
+        # Every primitive is clipped to this rect, the whole screen by default
+        self.clip = pygame.Rect(0, 0, width, height)
+
+        # Persistent background layer. Moving objects restore the region they
+        # covered from it instead of being painted over in black.
+        self.background = np.zeros((height, width, 3), dtype=np.uint8)
+        self.display_list = DisplayList(self)
+
+        self.textures = TextureRegistry(os.path.join(cg_dir, "resources"))
+
+        # Optional (H, W, 4) RGBA framebuffer. Every primitive writes into it
+        # and it is blitted to the display once per update. The pygame surface
+        # below shares its memory, so presenting a frame never copies it twice.
+        self.framebuffer = None
+
+        if framebuffer:
+            self.framebuffer = np.zeros((height, width, 4), dtype=np.uint8)
+            self.framebuffer[..., 3] = 255
+
+            self.framebuffer_surface = pygame.image.frombuffer(
+                self.framebuffer, (width, height), "RGBX"
+            )
+
     def run(self):
         while True:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     pygame.quit()
-            pygame.display.update()
+            self.update()
+
+    def update(self):
+        self.frames += 1
+
+        rects = merge_rects(self.dirty)
+        self.dirty = []
+
+        full = sum(rect.w * rect.h for rect in rects) > (
+            self.dirty_threshold * self.width * self.height
+        )
+
+        if self.framebuffer is not None:
+            if full:
+                self.surface.blit(self.framebuffer_surface, (0, 0))
+            else:
+                for rect in rects:
+                    self.surface.blit(self.framebuffer_surface, rect, rect)
+
+        if not self.headless:
+            if full:
+                pygame.display.update()
+            elif rects:
+                pygame.display.update(rects)
+
+        if self.on_update:
+            self.on_update(self)
+
+    def mark_dirty(self, x1, y1, x2, y2):
+        # Records the [x1, x2] x [y1, y2] pixels as changed. Primitives mark
+        # their bounds once, the span and pixel writers below them don't.
+        x1 = max(int(x1), 0)
+        y1 = max(int(y1), 0)
+        x2 = min(int(x2), self.width - 1)
+        y2 = min(int(y2), self.height - 1)
+
+        if x1 > x2 or y1 > y2:
+            return
+
+        self.dirty.append(pygame.Rect(x1, y1, x2 - x1 + 1, y2 - y1 + 1))
+
+    def set_clip(self, rect=None):
+        screen = pygame.Rect(0, 0, self.width, self.height)
+
+        self.clip = screen if rect is None else screen.clip(rect)
+
+    def polygon_rect(self, polygon):
+        # Screen rect holding every pixel the polygon can cover
+        x1, y1, x2, y2 = polygon.get_rectangle_bounds()
+
+        rect = pygame.Rect(floor(x1), floor(y1), 0, 0)
+        rect.w = floor(x2) - rect.x + 1
+        rect.h = floor(y2) - rect.y + 1
+
+        return rect.clip(0, 0, self.width, self.height)
+
+    def save_background(self):
+        self.background = self.pixels()[..., :3].copy()
+
+    def restore_background(self, rect):
+        # One array copy puts the background back over rect
+        rect = rect.clip(0, 0, self.width, self.height)
+
+        if not rect.w or not rect.h:
+            return
+
+        self.pixels()[rect.top : rect.bottom, rect.left : rect.right, :3] = (
+            self.background[rect.top : rect.bottom, rect.left : rect.right]
+        )
+        self.dirty.append(rect)
+
+    def get_frame(self):
+        if self.framebuffer is not None:
+            return self.framebuffer.copy()
+
+        frame = np.full((self.height, self.width, 4), 255, dtype=np.uint8)
+        frame[..., :3] = pygame.surfarray.array3d(self.surface).swapaxes(0, 1)
+
+        return frame
+
+    def fill(self, color):
+        if self.framebuffer is not None:
+            self.framebuffer[..., :3] = color.get_color()[:3]
+        else:
+            self.surface.fill(color.get_color())
+
+        self.mark_dirty(0, 0, self.width - 1, self.height - 1)
 
     def check_for_quit(self):
         for event in pygame.event.get():
@@ -172,16 +924,156 @@ class Game:
                 pygame.quit()
 
     def set_pixel(self, x, y, color):
-        x = int(min(max(x, 0), self.width - 1))
-        y = int(min(max(y, 0), self.height - 1))
+        # Pixels outside the clip rect are dropped, not moved to its border
+        x = int(x)
+        y = int(y)
+
+        if not self.clip.collidepoint(x, y):
+            return
+
+        self.mark_dirty(x, y, x, y)
+
+        if self.framebuffer is None:
+            gfxdraw.pixel(self.surface, x, y, color.get_color())
+            return
+
+        if color.a == 255:
+            self.framebuffer[y, x, :3] = (color.r, color.g, color.b)
+            return
 
-        gfxdraw.pixel(self.surface, x, y, color.get_color())
+        # Same source-over blending gfxdraw applies to translucent pixels
+        a = color.a / 255
+        dst = self.framebuffer[y, x, :3]
+        dst[:] = np.array((color.r, color.g, color.b)) * a + dst * (1 - a)
 
     def get_pixel(self, x, y):
-        color = self.surface.get_at((x, y))
+        if self.framebuffer is not None:
+            color = self.framebuffer[y, x]
+        else:
+            color = self.surface.get_at((x, y))
 
         return (color[0], color[1], color[2], color[3])
 
+    def fill_span(self, y, x1, x2, color):
+        # Clip the [x1, x2] run to the clip rect instead of clamping every pixel
+        if y < self.clip.top or y >= self.clip.bottom:
+            return
+
+        x1 = max(x1, self.clip.left)
+        x2 = min(x2, self.clip.right - 1)
+
+        if x1 > x2:
+            return
+
+        if self.framebuffer is not None:
+            self.framebuffer[y, x1 : x2 + 1, :3] = color.get_color()[:3]
+        else:
+            self.surface.fill(color.get_color(), (x1, y, x2 - x1 + 1, 1))
+
+    def write_span(self, y, x1, colors):
+        # Writes an (n, 3+) block of colors to row y starting at x1, clipped
+        # like fill_span
+        if y < self.clip.top or y >= self.clip.bottom:
+            return
+
+        x2 = x1 + len(colors) - 1
+
+        if x1 < self.clip.left:
+            colors = colors[self.clip.left - x1 :]
+            x1 = self.clip.left
+
+        if x2 >= self.clip.right:
+            colors = colors[: len(colors) - (x2 - self.clip.right + 1)]
+            x2 = self.clip.right - 1
+
+        if x1 > x2:
+            return
+
+        self.pixels()[y, x1 : x2 + 1, :3] = colors[:, :3]
+
+    def write_pixels(self, xs, ys, colors):
+        # Scatters one color, or one color per (x, y) pixel, dropping the pixels
+        # outside the clip rect
+        xs = np.asarray(xs).astype(int)
+        ys = np.asarray(ys).astype(int)
+
+        inside = self.inside_clip(xs, ys)
+
+        if colors.ndim > 1:
+            colors = colors[inside]
+
+        xs = xs[inside]
+        ys = ys[inside]
+
+        if not len(xs):
+            return
+
+        self.mark_dirty(xs.min(), ys.min(), xs.max(), ys.max())
+
+        self.pixels()[ys, xs, :3] = colors
+
+    def blend_pixels(self, xs, ys, colors, alpha):
+        # Source-over compositing of (n, 3) colors with per pixel alpha in
+        # [0, 1]. A pixel that repeats is blended once per occurrence, in
+        # order, so shared line ends get every contribution.
+        xs = np.asarray(xs).astype(int)
+        ys = np.asarray(ys).astype(int)
+
+        inside = self.inside_clip(xs, ys)
+
+        xs = xs[inside]
+        ys = ys[inside]
+        colors = colors[inside]
+        alpha = alpha[inside, None]
+
+        if not len(xs):
+            return
+
+        self.mark_dirty(xs.min(), ys.min(), xs.max(), ys.max())
+
+        # Occurrence number of every pixel among the ones before it. Each
+        # round blends the pixels with the same occurrence, all distinct.
+        keys = ys * self.width + xs
+        order = np.argsort(keys, kind="stable")
+
+        positions = np.arange(len(keys))
+        starts = np.diff(keys[order], prepend=-1) != 0
+
+        rank = np.empty(len(keys), dtype=int)
+        rank[order] = positions - np.maximum.accumulate(np.where(starts, positions, 0))
+
+        pixels = self.pixels()
+
+        for occurrence in range(rank.max() + 1):
+            layer = rank == occurrence
+
+            x = xs[layer]
+            y = ys[layer]
+            a = alpha[layer]
+
+            pixels[y, x, :3] = colors[layer] * a + pixels[y, x, :3] * (1 - a)
+
+    def inside_clip(self, xs, ys):
+        clip = self.clip
+
+        return (
+            (xs >= clip.left)
+            & (xs < clip.right)
+            & (ys >= clip.top)
+            & (ys < clip.bottom)
+        )
+
+    def pixels(self):
+        # (H, W, C) view of the frame: the framebuffer, or the surface pixels
+        # (which stays locked while the returned view is alive)
+        if self.framebuffer is not None:
+            return self.framebuffer
+
+        return pygame.surfarray.pixels3d(self.surface).swapaxes(0, 1)
+
+    def color_mask(self, color):
+        return (self.pixels()[..., :3] == color.get_color()[:3]).all(axis=2)
+
     def get_pixel_with_texture(self, texture, x, y):
         num_rows, num_cols, _ = texture.shape
 
@@ -191,462 +1083,540 @@ class Game:
         x = int(x * (num_cols - 1))
         y = int(y * (num_rows - 1))
 
-        color = texture[y][x]
+        color = texture[y][x]
+
+        return (color[0], color[1], color[2])
+
+    def sin(self):
+        # Plotted as one batch, which is also one dirty rect
+        xs = np.arange(self.width)
+        ys = (self.height / 2 + 25 * np.sin(xs * 0.05)).astype(int)
+
+        self.write_pixels(xs, ys, np.array((255, 0, 0)))
+
+    def line(self, xi, yi, xf, yf, color):
+        self.draw_lines([(xi, yi, xf, yf)], color)
+
+    def line_DDA(self, xi, yi, xf, yf, color):
+        self.draw_lines([(xi, yi, xf, yf)], color)
+
+    def line_DDAAA(self, xi, yi, xf, yf, color):
+        self.draw_lines([(xi, yi, xf, yf)], color, method="wu")
+
+    def line_bresenham(self, xi, yi, xf, yf, color):
+        self.draw_lines([(xi, yi, xf, yf)], color, method="bresenham")
+
+    def draw_lines(self, segments, colors, method="dda"):
+        # Rasterizes N (xi, yi, xf, yf) segments at once. Every segment gets
+        # max(|dx|, |dy|) pixels (the end point is left out, as before), all
+        # of them generated together and scattered in one write.
+        segments = np.asarray(segments).reshape(-1, 4)
+
+        if len(segments) == 0:
+            return
+
+        if isinstance(colors, Color):
+            colors = [colors] * len(segments)
 
-        return (color[0], color[1], color[2])
+        if method == "wu":
+            self.draw_antialiased_lines(segments, colors)
+            return
 
-    def sin(self):
-        for x in range(self.width):
-            y = int((self.height / 2) + 25 * sin(x * 0.05))
+        colors = np.array([color.get_color()[:3] for color in colors], dtype=np.uint8)
 
-            self.set_pixel(x, y, (255, 0, 0))
+        if method == "bresenham":
+            segments = segments.astype(int)
+
+        xi, yi, xf, yf = segments.T
 
-    def line(self, xi, yi, xf, yf, color):
         dx = xf - xi
         dy = yf - yi
 
-        if dx == 0 and dy == 0:
-            self.set_pixel(xi, yi, color)
-            return
-
-        changed = False
+        major = np.maximum(np.abs(dx), np.abs(dy)).astype(int)
 
-        if abs(dy) > abs(dx):
-            dx, dy = dy, dx
-            xi, yi = yi, xi
-
-            changed = True
+        if method == "bresenham":
+            counts = major
+        else:
+            # A zero length DDA line still plots its start point
+            counts = np.maximum(major, 1)
 
-        a = dy / dx
+        step_x = np.divide(dx, major, out=np.zeros(len(segments)), where=major > 0)
+        step_y = np.divide(dy, major, out=np.zeros(len(segments)), where=major > 0)
 
-        for vx in range(abs(dx)):
-            if dx < 0:
-                vx = -vx
+        first, last = self.clip_lines(xi, yi, xf, yf, step_x, step_y, counts)
 
-            vy = a * vx
+        # Only the steps left inside the clip rect are generated
+        counts = last - first + 1
 
-            x = xi + vx
-            y = yi + vy
+        owners = np.repeat(np.arange(len(segments)), counts)
+        steps = (
+            np.arange(counts.sum())
+            - np.repeat(np.cumsum(counts) - counts, counts)
+            + first[owners]
+        )
 
-            if changed:
-                self.set_pixel(x, y, color)
-            else:
-                self.set_pixel(y, x, color)
+        if method == "bresenham":
+            x_major = np.abs(dx) > np.abs(dy)
+            minor = np.minimum(np.abs(dx), np.abs(dy))
 
-    def line_DDA(self, xi, yi, xf, yf, color):
-        dx = xf - xi
-        dy = yf - yi
+            x_sign = np.where(dx > 0, 1, -1)
+            y_sign = np.where(dy > 0, 1, -1)
 
-        steps = max(abs(dx), abs(dy))
+            # Closed form of the decision variable: the minor axis advances
+            # floor((2 * i * minor + major) / (2 * major)) times by step i
+            offsets = (2 * steps * minor[owners] + major[owners]) // (
+                2 * major[owners]
+            )
 
-        if steps == 0:
-            self.set_pixel(xi, yi, color)
-            return
+            xs = xi[owners] + np.where(
+                x_major[owners], steps * x_sign[owners], offsets * x_sign[owners]
+            )
+            ys = yi[owners] + np.where(
+                x_major[owners], offsets * y_sign[owners], steps * y_sign[owners]
+            )
+        else:
+            xs = xi[owners] + steps * step_x[owners]
+            ys = yi[owners] + steps * step_y[owners]
+
+        self.write_pixels(xs, ys, colors[owners])
+
+    def clip_lines(self, xi, yi, xf, yf, step_x, step_y, counts):
+        # Range of steps of every segment that can land in the clip rect. The
+        # box is a couple of pixels wider, as pixels are rounded off the exact
+        # line, and write_pixels drops the few that still fall outside.
+        bounds = (
+            self.clip.left - 2,
+            self.clip.top - 2,
+            self.clip.right + 1,
+            self.clip.bottom + 1,
+        )
 
-        step_x = dx / steps
-        step_y = dy / steps
+        start = outcodes(xi, yi, bounds)
+        end = outcodes(xf, yf, bounds)
 
-        for i in range(steps):
-            x = xi + i * step_x
-            y = yi + i * step_y
+        first = np.zeros(len(counts))
+        last = counts - 1.0
 
-            self.set_pixel(x, y, color)
+        # Segments with both ends inside are accepted as they are, the rest
+        # are clipped parametrically
+        clip_x = clip_steps(xi, step_x, bounds[0], bounds[2], first, last)
+        clip_y = clip_steps(yi, step_y, bounds[1], bounds[3], *clip_x)
 
-    def line_DDAAA(self, xi, yi, xf, yf, color):
-        dx = xf - xi
-        dy = yf - yi
+        partial = (start | end) != 0
 
-        steps = max(abs(dx), abs(dy))
+        first = np.ceil(np.where(partial, clip_y[0], first)).astype(int)
+        last = np.floor(np.where(partial, clip_y[1], last)).astype(int)
 
-        if steps == 0:
-            self.set_pixel(xi, yi, color)
-            return
+        # Both ends beyond the same side: rejected without any step
+        last = np.where(start & end, first - 1, np.maximum(last, first - 1))
 
-        step_x = dx / steps
-        step_y = dy / steps
+        return first, last
 
-        for i in range(steps):
-            x = xi + i * step_x
-            y = yi + i * step_y
+    def draw_antialiased_lines(self, segments, colors):
+        # Xiaolin Wu lines: one column (or row, for steep lines) per major axis
+        # step, split between the two pixels straddling the exact line by
+        # coverage. Weights for every segment are computed as arrays and
+        # composited in one blend.
+        segments = np.asarray(segments, dtype=float).reshape(-1, 4)
 
-            if abs(ceil(step_x)) == 1:
-                yd = y - floor(y)
+        if len(segments) == 0:
+            return
 
-                a = ceil((1 - yd) * 255)
-                self.set_pixel(ceil(x), floor(y), color.with_alpha(a))
+        colors = np.array([color.get_color() for color in colors], dtype=float)
 
-                a = ceil(yd * 255)
-                self.set_pixel(ceil(x), floor(y + 1), color.with_alpha(a))
-            else:
-                xd = x - floor(x)
+        x0, y0, x1, y1 = segments.T.copy()
 
-                a = ceil((1 - xd) * 255)
-                self.set_pixel(floor(x), ceil(y), color.with_alpha(a))
+        steep = np.abs(y1 - y0) > np.abs(x1 - x0)
+        x0[steep], y0[steep] = y0[steep], x0[steep]
+        x1[steep], y1[steep] = y1[steep], x1[steep]
 
-                a = ceil(xd * 255)
-                self.set_pixel(floor(x + 1), ceil(y), color.with_alpha(a))
+        backwards = x0 > x1
+        x0[backwards], x1[backwards] = x1[backwards], x0[backwards]
+        y0[backwards], y1[backwards] = y1[backwards], y0[backwards]
 
-    def line_bresenham(self, xi, yi, xf, yf, color):
-        dx = xf - xi
-        dy = yf - yi
+        dx = x1 - x0
+        gradient = np.divide(y1 - y0, dx, out=np.ones(len(segments)), where=dx > 0)
 
-        x_sign = 1 if dx > 0 else -1
-        y_sign = 1 if dy > 0 else -1
+        x_start = np.floor(x0 + 0.5)
+        x_end = np.floor(x1 + 0.5)
 
-        dx = abs(dx)
-        dy = abs(dy)
+        counts = (x_end - x_start).astype(int) + 1
 
-        if dx > dy:
-            xx, xy, yx, yy = x_sign, 0, 0, y_sign
-        else:
-            dx, dy = dy, dx
-            xx, xy, yx, yy = 0, y_sign, x_sign, 0
+        # Clipped in the swapped space, where x is always the major axis
+        clip = self.clip
+        bounds = np.array(
+            [
+                np.where(steep, clip.top, clip.left) - 2,
+                np.where(steep, clip.left, clip.top) - 2,
+                np.where(steep, clip.bottom, clip.right) + 1,
+                np.where(steep, clip.right, clip.bottom) + 1,
+            ]
+        )
 
-        dx2 = 2 * dx
-        dy2 = 2 * dy
+        first, last = clip_steps(
+            x_start, np.ones(len(segments)), bounds[0], bounds[2], 0, counts - 1.0
+        )
+        first, last = clip_steps(
+            y0 + gradient * (x_start - x0), gradient, bounds[1], bounds[3], first, last
+        )
 
-        p = dy2 - dx
-        y = 0
+        first = np.ceil(first).astype(int)
+        last = np.maximum(np.floor(last).astype(int), first - 1)
+        visible = last - first + 1
 
-        for x in range(dx):
-            self.set_pixel(xi + x * xx + y * yx, yi + x * xy + y * yy, color)
+        owners = np.repeat(np.arange(len(segments)), visible)
+        steps = (
+            np.arange(visible.sum())
+            - np.repeat(np.cumsum(visible) - visible, visible)
+            + first[owners]
+        )
 
-            if p >= 0:
-                y += 1
-                p -= dx2
+        xs = x_start[owners] + steps
+        intery = y0[owners] + gradient[owners] * (xs - x0[owners])
 
-            p += dy2
+        ys = np.floor(intery)
+        fraction = intery - ys
 
-    def circumference(self, xc, yc, r, color):
-        x = 0
-        y = r
+        # End points only cover the part of their pixel the segment reaches
+        gap = np.ones(len(xs))
+        first = steps == 0
+        last = steps == counts[owners] - 1
 
-        sectors = [(1, 1), (-1, 1), (1, -1), (-1, -1)]
+        gap[first] *= 1 - (x0 + 0.5 - np.floor(x0 + 0.5))[owners[first]]
+        gap[last] *= (x1 + 0.5 - np.floor(x1 + 0.5))[owners[last]]
 
-        p = 3 - 2 * r
+        alpha = np.concatenate(((1 - fraction) * gap, fraction * gap))
+        alpha *= np.tile(colors[owners, 3] / 255, 2)
 
-        while y >= x:
-            x_aux, y_aux = y, x
+        major = np.concatenate((xs, xs))
+        minor = np.concatenate((ys, ys + 1))
+        owners = np.tile(owners, 2)
 
-            for x_signal, y_signal in sectors:
-                self.set_pixel(xc + x_signal * x, yc + y_signal * y, color)
-                self.set_pixel(xc + x_signal * x_aux, yc + y_signal * y_aux, color)
+        px = np.where(steep[owners], minor, major)
+        py = np.where(steep[owners], major, minor)
 
-            x += 1
+        self.blend_pixels(px, py, colors[owners, :3], alpha)
 
-            if p > 0:
-                y -= 1
-                p += 4 * (x - y) + 10
-            else:
-                p += 4 * x + 6
+    def outside_clip(self, x1, y1, x2, y2):
+        # Bounding box test rejecting a whole primitive before any pixel work
+        clip = self.clip
 
-    def ellipse(self, xc, yc, rx, ry, color):
-        x = 0
-        y = abs(ry)
+        return x2 < clip.left or x1 >= clip.right or y2 < clip.top or y1 >= clip.bottom
 
-        sectors = [(1, 1), (-1, 1), (1, -1), (-1, -1)]
+    def circumference(self, xc, yc, r, color):
+        if self.outside_clip(xc - r, yc - r, xc + r, yc + r):
+            return
 
-        rx_squared = rx**2
-        ry_squared = ry**2
+        dx, dy = circumference_offsets(r)
 
-        px = 0
-        py = 2 * rx_squared * y
+        self.write_pixels(xc + dx, yc + dy, np.array(color.get_color()[:3]))
 
-        p = ry_squared - (rx_squared * ry) + (0.25 * rx_squared)
+    def ellipse(self, xc, yc, rx, ry, color):
+        if self.outside_clip(xc - rx, yc - ry, xc + rx, yc + ry):
+            return
 
-        while px <= py:
-            x_aux, y_aux = x, y
+        dx, dy = ellipse_offsets(rx, ry)
 
-            for x_signal, y_signal in sectors:
-                self.set_pixel(xc + x_signal * x, yc + y_signal * y, color)
-                self.set_pixel(xc + x_signal * x_aux, yc + y_signal * y_aux, color)
+        self.write_pixels(xc + dx, yc + dy, np.array(color.get_color()[:3]))
 
-            x += 1
-            px += 2 * ry_squared
+    def fill_circle(self, xc, yc, r, color):
+        if self.outside_clip(xc - r, yc - r, xc + r, yc + r):
+            return
 
-            if p < 0:
-                p += ry_squared + px
-            else:
-                y -= 1
-                py -= 2 * rx_squared
-                p += ry_squared + px - py
-
-        p = (
-            ry_squared * (x + 0.5) ** 2
-            + rx_squared * (y - 1) ** 2
-            - rx_squared * ry_squared
-        )
+        self.mark_dirty(xc - r, yc - r, xc + r, yc + r)
 
-        while y >= 0:
-            x_aux, y_aux = x, y
+        for dy, half_width in zip(*circumference_spans(r)):
+            self.fill_span(yc + dy, xc - half_width, xc + half_width, color)
 
-            for x_signal, y_signal in sectors:
-                self.set_pixel(xc + x_signal * x, yc + y_signal * y, color)
-                self.set_pixel(xc + x_signal * x_aux, yc + y_signal * y_aux, color)
+    def fill_ellipse(self, xc, yc, rx, ry, color):
+        if self.outside_clip(xc - rx, yc - ry, xc + rx, yc + ry):
+            return
 
-            y -= 1
-            py -= 2 * rx_squared
+        self.mark_dirty(xc - rx, yc - ry, xc + rx, yc + ry)
 
-            if p > 0:
-                p += rx_squared - py
-            else:
-                x += 1
-                px += 2 * ry_squared
-                p += rx_squared - py + px
+        for dy, half_width in zip(*ellipse_spans(rx, ry)):
+            self.fill_span(yc + dy, xc - half_width, xc + half_width, color)
 
     def flood_fill(self, x, y, color, animation=False):
         initial_color = Color(self.get_pixel(x, y))
 
         if color == initial_color:
-            return
+            return []
 
+        # Pixels still to be filled. Runs are cleared as they are painted, so
+        # every pixel is scanned once and the stack only holds span seeds.
+        mask = self.color_mask(initial_color)
+
+        spans = []
         stack = [(x, y)]
 
         while stack:
             x, y = stack.pop()
 
-            if Color(self.get_pixel(x, y)) != initial_color:
-                continue
-
-            if animation:
-                time.sleep(0.000001)
-                pygame.display.update()
-
-            self.set_pixel(x, y, color)
-
-            if x + 1 < self.width:
-                stack.append((x + 1, y))
+            row = mask[y]
 
-            if x >= 1:
-                stack.append((x - 1, y))
-
-            if y + 1 < self.height:
-                stack.append((x, y + 1))
-
-            if y >= 1:
-                stack.append((x, y - 1))
+            if not row[x]:
+                continue
 
-    def boundary_fill(self, x, y, color, border_color=None):
-        stack = [(x, y)]
+            left = row[x::-1]
+            i = left.argmin()
+            x1 = x - i + 1 if not left[i] else 0
 
-        if not border_color:
-            border_color = color
+            right = row[x:]
+            i = right.argmin()
+            x2 = x + i - 1 if not right[i] else self.width - 1
 
-        while stack:
-            x, y = stack.pop()
+            row[x1 : x2 + 1] = False
 
-            color_aux = Color(self.get_pixel(x, y))
+            if animation:
+                time.sleep(0.000001)
+                self.update()
 
-            if color_aux in [border_color, color]:
-                continue
+            self.fill_span(y, x1, x2, color)
+            spans.append((y, x1, x2))
 
-            self.set_pixel(x, y, color)
+            if animation:
+                self.mark_dirty(x1, y, x2, y)
 
-            if x + 1 < self.width:
-                stack.append((x + 1, y))
+            for ny in (y - 1, y + 1):
+                if ny < 0 or ny >= self.height:
+                    continue
 
-            if x >= 1:
-                stack.append((x - 1, y))
+                run = mask[ny, x1 : x2 + 1]
+                starts = np.flatnonzero(run[1:] & ~run[:-1]) + 1
 
-            if y + 1 < self.height:
-                stack.append((x, y + 1))
+                if run[0]:
+                    stack.append((x1, ny))
 
-            if y >= 1:
-                stack.append((x, y - 1))
+                stack.extend((x1 + start, ny) for start in starts.tolist())
 
-    def draw_polygon(self, polygon, color):
-        for i in range(len(polygon.points)):
-            xi, yi = polygon.points[i][:2]
-            xf, yf = polygon.points[(i + 1) % len(polygon.points)][:2]
+        ys, x1s, x2s = zip(*spans)
+        self.mark_dirty(min(x1s), min(ys), max(x2s), max(ys))
 
-            self.line_DDA(int(xi), int(yi), int(xf), int(yf), color)
+        return spans
 
-    def intersection_base(self, y, segment):
-        xi = segment[0][0]
-        yi = segment[0][1]
-        xf = segment[1][0]
-        yf = segment[1][1]
+    def boundary_fill(self, x, y, color, border_color=None):
+        # Without a border color, it fills up to pixels of its own color
+        if border_color is None:
+            border_color = color
 
-        # Horizontal segment (has no intersection)
-        if yi == yf:
-            return -1
+        self.fill_regions([(x, y, color)], border_color=border_color)
 
-        # Secure starting point on top
-        if yi > yf:
-            xi, xf = xf, xi
-            yi, yf = yf, yi
+    def fill_regions(self, seeds, border_color=None, animation=False):
+        # Fills many (x, y, color) seeds at once, resolved against the frame as
+        # it was before the call. Without a border color each seed fills the
+        # 4-connected pixels sharing its color (flood fill). With one, it fills
+        # everything up to the border or its own fill color (boundary fill).
+        groups = {}
 
-        t = (y - yi) / (yf - yi)
+        for x, y, color in seeds:
+            if border_color:
+                key = color.get_color()[:3]
+            else:
+                key = tuple(int(c) for c in self.get_pixel(x, y)[:3])
 
-        return int(xi + t * (xf - xi)) if t > 0 and t <= 1 else -1
+                if key == color.get_color()[:3]:
+                    continue
 
-    def scanline_base(self, polygon, color):
-        y_min = polygon.y_min()
-        y_max = polygon.y_max()
+            groups.setdefault(key, []).append((x, y, color))
 
-        for y in range(y_min, y_max + 1):
-            intersections = []
+        # Every group is labeled before anything is written, so a fill color
+        # can't leak into the region of a later seed
+        labeled = []
 
-            pix = polygon.points[0][0]
-            piy = polygon.points[0][1]
+        for key, group in groups.items():
+            if border_color:
+                mask = ~(
+                    self.color_mask(border_color) | self.color_mask(Color(key))
+                )
+            else:
+                mask = self.color_mask(Color(key))
 
-            for p in range(1, len(polygon.points)):
-                pfx = polygon.points[p][0]
-                pfy = polygon.points[p][1]
+            # One labeling pass per group, then a lookup table maps every
+            # labeled region to its fill color
+            labeled.append((group, *self.label_regions(mask)))
 
-                xi = self.intersection_base(y, [[pix, piy], [pfx, pfy]])
+        for group, labels, count in labeled:
+            table = np.zeros((count + 1, 3), dtype=np.uint8)
+            filled = np.zeros(count + 1, dtype=bool)
 
-                if xi >= 0:
-                    intersections.append(xi)
+            for x, y, color in group:
+                label = labels[y, x]
 
-                pix = pfx
-                piy = pfy
+                if label:
+                    table[label] = color.get_color()[:3]
+                    filled[label] = True
 
-            pfx = polygon.points[0][0]
-            pfy = polygon.points[0][1]
+                    if animation:
+                        region = labels == label
+                        self.pixels()[region, :3] = table[label]
+                        self.mark_region_dirty(region)
 
-            xi = self.intersection_base(y, [[pix, piy], [pfx, pfy]])
+                        time.sleep(0.1)
+                        self.update()
 
-            if xi >= 0:
-                intersections.append(xi)
+            region = filled[labels]
+            self.pixels()[region, :3] = table[labels[region]]
+            self.mark_region_dirty(region)
 
-            for pi in range(0, len(intersections), 2):
-                x1 = intersections[pi]
-                x2 = intersections[pi + 1]
+    def mark_region_dirty(self, region):
+        rows = np.flatnonzero(region.any(axis=1))
+        cols = np.flatnonzero(region.any(axis=0))
 
-                if x2 < x1:
-                    x1, x2 = x2, x1
+        if len(rows):
+            self.mark_dirty(cols[0], rows[0], cols[-1], rows[-1])
 
-                for xk in range(x1, x2 + 1):
-                    self.set_pixel(xk, y, color)
+    def label_regions(self, mask):
+        # 4-connected component labeling of a boolean mask. Horizontal runs
+        # are found with NumPy, runs touching vertically are merged with a
+        # union-find, so the Python work grows with runs instead of pixels.
+        height, width = mask.shape
 
-    def intersection_with_color_gradient(self, y, segment):
-        xi = segment[0][0]
-        yi = segment[0][1]
-        c1 = segment[0][2]
+        edges = np.diff(mask.astype(np.int8), axis=1, prepend=0)
+        starts = np.flatnonzero(edges.ravel() == 1)
 
-        xf = segment[1][0]
-        yf = segment[1][1]
-        c2 = segment[1][2]
+        markers = np.zeros(height * width, dtype=np.int32)
+        markers[starts] = 1
 
-        # Horizontal segment (has no intersection)
-        if yi == yf:
-            return -1, c1
+        runs = np.cumsum(markers).reshape(height, width) * mask
 
-        # Secure starting point on top
-        if yi > yf:
-            xi, xf = xf, xi
-            yi, yf = yf, yi
-            c1, c2 = c2, c1
+        touching = mask[1:] & mask[:-1]
+        pairs = np.unique(
+            np.stack((runs[:-1][touching], runs[1:][touching]), axis=1),
+            axis=0,
+        )
 
-        t = (y - yi) / (yf - yi)
+        parent = list(range(len(starts) + 1))
 
-        if t > 0 and t <= 1:
-            c = c1.sub_color_gradient(c2, t)
-            return int(xi + t * (xf - xi)), c
+        def find(run):
+            while parent[run] != run:
+                parent[run] = parent[parent[run]]
+                run = parent[run]
 
-        return -1, c1
+            return run
 
-    def scanline_with_color_gradient(self, polygon):
-        y_min = polygon.y_min()
-        y_max = polygon.y_max()
+        for a, b in pairs.tolist():
+            a = find(a)
+            b = find(b)
 
-        for y in range(y_min, y_max + 1):
-            intersections = []
+            if a != b:
+                parent[max(a, b)] = min(a, b)
 
-            for p in range(len(polygon.points)):
-                xi, xic = self.intersection_with_color_gradient(
-                    y,
-                    [polygon.points[p], polygon.points[(p + 1) % len(polygon.points)]],
-                )
+        roots = np.array([find(run) for run in range(len(parent))])
 
-                if xi >= 0:
-                    intersections.append((xi, xic))
+        # Compact labels: 0 stays background, regions become 1..count
+        _, roots = np.unique(roots, return_inverse=True)
 
-            intersections.sort(key=lambda intersection: intersection[0])
+        return roots[runs], roots.max()
 
-            for pi in range(0, len(intersections), 2):
-                x1, c1 = intersections[pi]
-                x2, c2 = intersections[pi + 1]
+    def draw_polygon(self, polygon, color):
+        positions = polygon.positions
+        segments = np.hstack((positions, np.roll(positions, -1, axis=0)))
 
-                if x1 == x2:
-                    continue
+        self.draw_lines(segments.astype(int), color)
 
-                if x2 < x1:
-                    x1, x2 = x2, x1
-                    c1, c2 = c2, c1
+    def scanline(self, polygon, shader):
+        x1, y1, x2, y2 = polygon.get_rectangle_bounds()
 
-                for xk in range(x1, x2 + 1):
-                    p = (xk - x1) / (x2 - x1)
+        if self.outside_clip(x1, y1, x2, y2):
+            return
 
-                    interpolated_color = c1.sub_color_gradient(c2, p)
+        points = polygon.positions.tolist()
+        attributes = shader.attributes(polygon)
 
-                    self.set_pixel(xk, y, interpolated_color)
+        edges = []
 
-    def intersection_with_texture(self, y, segment):
-        pi = segment[0]
-        pf = segment[1]
+        # Edge table: every non-horizontal edge covers the scanlines strictly
+        # below its top vertex down to its bottom vertex, so a vertex shared by
+        # two edges is counted once unless it is a local extreme.
+        for i in range(len(points)):
+            j = (i + 1) % len(points)
 
-        # Horizontal segment (has no intersection)
-        if pi[1] == pf[1]:
-            return [-1, 0, 0, 0]
+            pi = points[i]
+            pf = points[j]
+            ai = attributes[i]
+            af = attributes[j]
 
-        # Secure starting point on top
-        if pi[1] > pf[1]:
-            pi, pf = pf, pi
+            if pi[1] == pf[1]:
+                continue
 
-        t = (y - pi[1]) / (pf[1] - pi[1])
+            if pi[1] > pf[1]:
+                pi, pf = pf, pi
+                ai, af = af, ai
 
-        if t > 0 and t <= 1:
-            x = pi[0] + t * (pf[0] - pi[0])
+            # Every edge is clipped to the rows of the clip rect, so no row off
+            # it is ever stepped through. Cutting the polygon instead would
+            # move the vertices edges are evaluated from, and a partial redraw
+            # could round differently from a full one. Columns are clipped per
+            # span, which also keeps how vertex colors spread over a quad.
+            y_start = max(floor(pi[1]) + 1, self.clip.top)
+            y_end = min(floor(pf[1]), self.clip.bottom - 1)
 
-            tx = pi[2] + t * (pf[2] - pi[2])
-            ty = pi[3] + t * (pf[3] - pi[3])
+            if y_start > y_end:
+                continue
 
-            return [x, y, tx, ty]
+            edges.append(Edge(pi, pf, ai, af, y_start, y_end))
 
-        return [-1, 0, 0, 0]
+        if not edges:
+            return
 
-    def scanline_with_texture(self, polygon, texture):
-        y_min = polygon.y_min()
-        y_max = polygon.y_max()
+        self.mark_dirty(
+            floor(min(point[0] for point in points)),
+            min(edge.y_start for edge in edges),
+            floor(max(point[0] for point in points)),
+            max(edge.y_end for edge in edges),
+        )
 
-        for y in range(y_min, y_max + 1):
-            intersections = []
+        edges.sort(key=lambda edge: edge.y_start)
 
-            for p in range(len(polygon.points)):
-                pi = polygon.points[p]
-                pf = polygon.points[(p + 1) % len(polygon.points)]
+        active = []
+        next_edge = 0
+        y = edges[0].y_start
 
-                intersection = self.intersection_with_texture(y, [pi, pf])
+        while active or next_edge < len(edges):
+            while next_edge < len(edges) and edges[next_edge].y_start == y:
+                active.append(edges[next_edge])
+                next_edge += 1
 
-                if intersection[0] >= 0:
-                    intersections.append(intersection)
+            active.sort(key=lambda edge: edge.x)
 
-            intersections.sort(key=lambda intersection: intersection[0])
+            for i in range(0, len(active) - 1, 2):
+                e1 = active[i]
+                e2 = active[i + 1]
 
-            for pi in range(0, len(intersections), 2):
-                p1 = intersections[pi]
-                p2 = intersections[pi + 1]
+                shader.shade(self, y, e1.x, e2.x, e1.attributes, e2.attributes)
 
-                x1 = p1[0]
-                x2 = p2[0]
+            active = [edge for edge in active if edge.y_end > y]
 
-                if x1 == x2:
-                    continue
+            y += 1
 
-                if x2 < x1:
-                    p1, p2 = p2, p1
+            for edge in active:
+                edge.move_to(y)
 
-                for xk in range(int(p1[0]), int(p2[0]) + 1):
-                    pc = (xk - p1[0]) / (p2[0] - p1[0])
+            if not active and next_edge < len(edges):
+                y = edges[next_edge].y_start
 
-                    tx = p1[2] + pc * (p2[2] - p1[2])
-                    ty = p1[3] + pc * (p2[3] - p1[3])
+    def scanline_base(self, polygon, color):
+        self.scanline(polygon, SolidSpanShader(color))
 
-                    color = Color(self.get_pixel_with_texture(texture, tx, ty))
+    def scanline_with_color_gradient(self, polygon):
+        self.scanline(polygon, GradientSpanShader())
 
-                    self.set_pixel(xk, y, color)
+    def scanline_with_texture(self, polygon, texture):
+        if isinstance(texture, Texture):
+            texture = texture.select_level(polygon)
+
+        self.scanline(polygon, TextureSpanShader(texture))
+
+    def fill_polygon(self, polygon, fill):
+        # A Color fills it solid, None with its vertex colors, anything else
+        # is a texture
+        if fill is None:
+            self.scanline_with_color_gradient(polygon)
+        elif isinstance(fill, Color):
+            self.scanline_base(polygon, fill)
+        else:
+            self.scanline_with_texture(polygon, fill)
 
     def create_transformation_matrix(self):
         return np.identity(3)
@@ -676,64 +1646,320 @@ class Game:
         )
 
     def compose_rotation(self, matrix, ang):
-        ang = (ang * pi) / 180
+        cos_ang, sin_ang = rotation(ang)
 
         return np.array(
             [
-                [cos(ang), -sin(ang), 0],
-                [sin(ang), cos(ang), 0],
+                [cos_ang, -sin_ang, 0],
+                [sin_ang, cos_ang, 0],
                 [0, 0, 1],
             ]
             @ matrix
         )
 
     def apply_transformation(self, polygon, matrix):
-        points = []
+        # Takes one polygon or a list of them and a 3x3 matrix or an Affine.
+        # The vertices of the whole batch are transformed at once, the
+        # attribute arrays are shared with the new polygons as they are.
+        polygons = polygon if isinstance(polygon, list) else [polygon]
+
+        if len(polygons) == 0:
+            return []
+
+        if isinstance(matrix, Affine):
+            transformed = matrix.apply(
+                np.concatenate([pol.positions for pol in polygons])
+            )
+        else:
+            positions = np.ones((sum(len(pol.positions) for pol in polygons), 3))
+            positions[:, :2] = np.concatenate([pol.positions for pol in polygons])
+
+            transformed = (positions @ np.transpose(matrix))[:, :2]
 
-        for i in range(len(polygon.points)):
-            pt = polygon.points[i][:2]
-            pt.append(1)
-            pt = np.transpose(pt)
+        results = []
+        start = 0
 
-            transformed_pt = matrix @ pt
+        for pol in polygons:
+            end = start + len(pol.positions)
 
-            transformed_pt = np.transpose(transformed_pt)
-            points.append(transformed_pt[:2].tolist())
+            results.append(
+                type(pol).from_arrays(
+                    transformed[start:end], pol.attributes, pol.color_attributes
+                )
+            )
 
-            for j in range(2, len(polygon.points[i])):
-                points[i].append(polygon.points[i][j])
+            start = end
 
-        if type(polygon) is Polygon:
-            return Polygon(points)
-        return TexturePolygon(points)
+        return results if isinstance(polygon, list) else results[0]
 
     def map_window(
         self,
         p,
         window,
         viewport,
+        transformation=None,
     ):
-        xiv = viewport[0]
-        yiv = viewport[1]
-        xfv = viewport[2]
-        yfv = viewport[3]
-        xi = window[0]
-        yi = window[1]
-        xf = window[2]
-        yf = window[3]
-
-        a = (xfv - xiv) / (xf - xi)
-        b = (yfv - yiv) / (yf - yi)
-
-        m = np.array(
-            [
-                [a, 0, xiv - a * xi],
-                [0, b, yiv - b * yi],
-                [0, 0, 1],
-            ]
+        # The window -> viewport mapping is cached per pair of rectangles. A
+        # model transformation is fused with it, so the vertices are only
+        # transformed once.
+        m = window_to_viewport(tuple(window), tuple(viewport))
+
+        if transformation is None:
+            return self.apply_transformation(p, m)
+
+        if isinstance(transformation, Affine):
+            return self.apply_transformation(p, transformation.copy().then(m))
+
+        return self.apply_transformation(p, m.matrix @ transformation)
+
+
+class Viewport:
+    def __init__(self, window, viewport):
+        # window is the [x1, y1, x2, y2] world region shown on the viewport
+        # [x1, y1, x2, y2] screen rect
+        self.window = tuple(window)
+        self.viewport = tuple(viewport)
+
+        self.mapping = window_to_viewport(self.window, self.viewport)
+
+        x1, y1, x2, y2 = self.viewport
+        self.rect = pygame.Rect(x1, y1, x2 - x1, y2 - y1)
+
+        # Mapped polygon and screen rect of every drawable, as last drawn
+        self.polygons = {}
+        self.rects = {}
+
+        # Screen rects to restore and redraw on the next render
+        self.dirty = []
+
+    def map(self, game, items):
+        # Maps the changed items in one batch. Their old and new rects, clipped
+        # to the viewport, become dirty.
+        polygons = game.apply_transformation(
+            [item.polygon for item in items], self.mapping
         )
 
-        return self.apply_transformation(p, m)
+        for item, polygon in zip(items, polygons):
+            if item in self.rects:
+                self.dirty.append(self.rects[item])
+
+            rect = game.polygon_rect(polygon).clip(self.rect)
+
+            self.polygons[item] = polygon
+            self.rects[item] = rect
+            self.dirty.append(rect)
+
+    def forget(self, item):
+        self.polygons.pop(item)
+        self.dirty.append(self.rects.pop(item))
+
+    def render(self, game, items):
+        # The dirty rects are restored from the background, then every item
+        # overlapping them is drawn again in order, clipped to them. The rest
+        # of the viewport is left as it is on screen.
+        damage = [rect for rect in merge_rects(self.dirty) if rect.w and rect.h]
+        self.dirty = []
+
+        for rect in damage:
+            game.restore_background(rect)
+
+        for item in items:
+            for rect in damage:
+                if self.rects[item].colliderect(rect):
+                    game.set_clip(rect)
+                    game.fill_polygon(self.polygons[item], item.fill)
+
+        game.set_clip()
+
+
+class Drawable:
+    __slots__ = ("polygon", "fill", "kind", "z", "changed")
+
+    def __init__(self, polygon, fill, z):
+        self.polygon = polygon
+        self.fill = fill
+        self.z = z
+
+        if fill is None:
+            self.kind = "color_gradient"
+        elif isinstance(fill, Color):
+            self.kind = "simple"
+        else:
+            self.kind = "texture"
+
+        self.changed = True
+
+    def order(self):
+        # Back to front, then grouped by fill kind and texture so consecutive
+        # draws share a shader and texture
+        return (self.z, self.kind, id(self.fill) if self.kind == "texture" else 0)
+
+
+class DisplayList:
+    def __init__(self, game):
+        self.game = game
+        self.items = []
+        self.viewports = []
+
+    def add_viewport(self, viewport):
+        self.viewports.append(viewport)
+
+        for item in self.items:
+            item.changed = True
+
+        return viewport
+
+    def add(self, polygon, fill, z=0):
+        # Registers a world space polygon, shown in every viewport. fill is a
+        # Color, a texture, or None for the polygon's vertex colors.
+        item = Drawable(polygon, fill, z)
+
+        self.items.append(item)
+        self.items.sort(key=Drawable.order)
+
+        return item
+
+    def move(self, item, polygon):
+        item.polygon = polygon
+        item.changed = True
+
+    def remove(self, item):
+        self.items.remove(item)
+
+        for viewport in self.viewports:
+            if item in viewport.rects:
+                viewport.forget(item)
+
+    def render(self):
+        # Redraws only what changed: changed items are mapped once per
+        # viewport, and each viewport redraws the regions they left or reach
+        changed = [item for item in self.items if item.changed]
+
+        for item in changed:
+            item.changed = False
+
+        for viewport in self.viewports:
+            if changed:
+                viewport.map(self.game, changed)
+
+            if viewport.dirty:
+                viewport.render(self.game, self.items)
+
+
+class Minimap:
+    def __init__(self, game, source, viewport):
+        # Shows the window of viewport as the source Viewport draws it, shrunk
+        # into the viewport's screen rect. Each minimap pixel is the mean of
+        # the source pixels it covers, so the window must not be smaller on
+        # screen than the viewport nor overlap it.
+        self.game = game
+
+        corners = source.mapping.apply(np.reshape(viewport.window, (2, 2)))
+        (x1, y1), (x2, y2) = corners.round().astype(int).tolist()
+
+        self.source = pygame.Rect(x1, y1, x2 - x1, y2 - y1)
+        self.target = viewport.rect
+
+        # Source pixels where every minimap column and row starts
+        self.col_edges = np.linspace(x1, x2, self.target.w + 1).astype(int)
+        self.row_edges = np.linspace(y1, y2, self.target.h + 1).astype(int)
+
+        self.downsample(pygame.Rect(0, 0, self.target.w, self.target.h))
+
+    def render(self):
+        # Downsamples only the minimap cells whose source pixels were drawn
+        # this frame, or that were drawn over themselves
+        cells = []
+
+        for rect in merge_rects(self.game.dirty):
+            part = rect.clip(self.source)
+
+            if part.w and part.h:
+                c1, c2 = np.searchsorted(
+                    self.col_edges, (part.left, part.right - 1), side="right"
+                ).tolist()
+                r1, r2 = np.searchsorted(
+                    self.row_edges, (part.top, part.bottom - 1), side="right"
+                ).tolist()
+
+                cells.append(pygame.Rect(c1 - 1, r1 - 1, c2 - c1 + 1, r2 - r1 + 1))
+
+            part = rect.clip(self.target)
+
+            if part.w and part.h:
+                cells.append(part.move(-self.target.left, -self.target.top))
+
+        for rect in merge_rects(cells):
+            self.downsample(rect)
+
+    def downsample(self, cells):
+        # Box filter of the source pixels under a rect of minimap cells, the
+        # sums of every row and column bin reduced in one call per axis
+        cols = self.col_edges[cells.left : cells.right + 1]
+        rows = self.row_edges[cells.top : cells.bottom + 1]
+
+        pixels = self.game.pixels()
+        block = pixels[rows[0] : rows[-1], cols[0] : cols[-1], :3].astype(np.uint32)
+
+        sums = np.add.reduceat(block, rows[:-1] - rows[0], axis=0)
+        sums = np.add.reduceat(sums, cols[:-1] - cols[0], axis=1)
+
+        counts = np.outer(np.diff(rows), np.diff(cols))[..., None]
+
+        rect = cells.move(self.target.left, self.target.top)
+        pixels[rect.top : rect.bottom, rect.left : rect.right, :3] = sums // counts
+
+        self.game.dirty.append(rect)
+
+
+class SpatialHash:
+    def __init__(self, cell_size=64):
+        # Uniform grid bucketing objects by the cells their bounds touch
+        self.cell_size = cell_size
+        self.cells = {}
+
+        # key -> (cx1, cy1, cx2, cy2) range of cells it is stored in
+        self.ranges = {}
+
+    def cell_range(self, bounds):
+        x1, y1, x2, y2 = bounds
+        size = self.cell_size
+
+        return (floor(x1 / size), floor(y1 / size), floor(x2 / size), floor(y2 / size))
+
+    def insert(self, key, bounds):
+        cells = self.cell_range(bounds)
+        self.ranges[key] = cells
+
+        for cell in self.range_cells(cells):
+            self.cells.setdefault(cell, set()).add(key)
+
+    def move(self, key, bounds):
+        # Buckets are only touched when the object crosses into other cells
+        if self.cell_range(bounds) != self.ranges[key]:
+            self.remove(key)
+            self.insert(key, bounds)
+
+    def remove(self, key):
+        for cell in self.range_cells(self.ranges.pop(key)):
+            bucket = self.cells[cell]
+            bucket.discard(key)
+
+            if not bucket:
+                del self.cells[cell]
+
+    def query(self, bounds):
+        found = set()
+
+        for cell in self.range_cells(self.cell_range(bounds)):
+            found.update(self.cells.get(cell, ()))
+
+        return found
+
+    def range_cells(self, cells):
+        cx1, cy1, cx2, cy2 = cells
+
+        return [(cx, cy) for cx in range(cx1, cx2 + 1) for cy in range(cy1, cy2 + 1)]
 
 
 class Cat:
@@ -741,13 +1967,10 @@ class Cat:
         self,
         game,
         steps,
-        windows,
-        viewports,
+        viewport,
     ):
         self.game = game
-        self.cat_texture = np.asarray(
-            Image.open(os.path.join(cg_dir, "resources", "cat.png")),
-        )
+        self.cat_texture = game.textures.get("cat.png")
         self.cat_pol = TexturePolygon(
             [
                 [210, 475, 0, 0],
@@ -757,74 +1980,66 @@ class Cat:
             ]
         )
         self.steps = steps
-        self.windows = windows
-        self.viewports = viewports
+        self.viewport = viewport
+
+        self.right_step = Affine().translate(steps, 0)
+        self.left_step = Affine().translate(-steps, 0)
 
-        self._draw_cat()
+        # Drawn in front of the enemies
+        self.drawable = game.display_list.add(self.cat_pol, self.cat_texture, z=1)
 
     def move_right(self):
-        x_actual = self.cat_pol.points[3][0]
-        if x_actual + self.steps >= self.viewports[0][2]:
+        x_actual = self.cat_pol.positions[3, 0]
+        if x_actual + self.steps >= self.viewport.window[2]:
             return
 
-        self._reset_pol()
-
-        m1 = self.game.create_transformation_matrix()
-        m1 = self.game.compose_translation(m1, self.steps, 0)
-
-        self.cat_pol = self.game.apply_transformation(self.cat_pol, m1)
-
-        self._draw_cat()
+        self._move(self.right_step)
 
     def move_left(self):
-        x_actual = self.cat_pol.points[1][0]
+        x_actual = self.cat_pol.positions[1, 0]
         if x_actual - self.steps <= 0:
             return
 
-        self._reset_pol()
-
-        m1 = self.game.create_transformation_matrix()
-        m1 = self.game.compose_translation(m1, -self.steps, 0)
-
-        self.cat_pol = self.game.apply_transformation(self.cat_pol, m1)
-
-        self._draw_cat()
+        self._move(self.left_step)
 
-    def _reset_pol(self):
-        pol = self.game.map_window(self.cat_pol, self.windows[0], self.viewports[0])
-        self.game.scanline_base(pol, Color((0, 0, 0)))
+    def _move(self, step):
+        self.cat_pol = self.game.apply_transformation(self.cat_pol, step)
 
-        pol = self.game.map_window(self.cat_pol, self.windows[1], self.viewports[1])
-        self.game.scanline_base(pol, Color((0, 0, 0)))
-
-    def _draw_cat(self):
-        pol = self.game.map_window(self.cat_pol, self.windows[0], self.viewports[0])
-        self.game.scanline_with_texture(pol, self.cat_texture)
-
-        pol = self.game.map_window(self.cat_pol, self.windows[1], self.viewports[1])
-        self.game.scanline_with_texture(pol, self.cat_texture)
+        self.game.display_list.move(self.drawable, self.cat_pol)
 
 
 class EnemyPolygons:
     def __init__(
         self,
         game,
-        windows,
-        viewports,
+        viewport,
+        fall_distance=4,
     ):
         self.game = game
-        self.viewports = viewports
-        self.windows = windows
+        self.viewport = viewport
         self.polygons = []
         self.enemys_removed = 0
 
+        # Broadphase for collisions, keyed by each enemy's drawable
+        self.grid = SpatialHash()
+
+        # Enemies fall fall_distance per tick. Collisions are swept over the
+        # last fall and the cat's motion since the previous check.
+        self.fall_distance = fall_distance
+        self.last_fall = 0
+        self.cat_position = None
+
+        # Decoded up front so spawning never touches the disk
+        self.textures = game.textures.names("enemys_textures")
+        game.textures.preload("enemys_textures")
+
     def create_random_polygon(self):
         colors = list(Color.get_default_colors().values())
 
         pol_width = random.randint(40, 90)
         pol_height = random.randint(40, 80)
 
-        pol_xi = random.randint(0, self.viewports[0][2] - pol_width)
+        pol_xi = random.randint(0, self.viewport.window[2] - pol_width)
         pol_yi = random.randint(0, 30)
 
         pol_points = [
@@ -859,135 +2074,103 @@ class EnemyPolygons:
 
         pol = Polygon(points=pol_points)
 
-        pol_aux1 = self.game.map_window(pol, self.windows[0], self.viewports[0])
-        pol_aux2 = self.game.map_window(pol, self.windows[1], self.viewports[1])
-
         if polygon_type == "simple":
-            color = random.choice(colors)
-            self.game.scanline_base(polygon=pol_aux1, color=color)
-            self.game.scanline_base(polygon=pol_aux2, color=color)
+            fill = random.choice(colors)
 
         elif polygon_type == "color_gradient":
-            self.game.scanline_with_color_gradient(polygon=pol_aux1)
-            self.game.scanline_with_color_gradient(polygon=pol_aux2)
+            fill = None
 
         else:
-            image = random.choice(
-                os.listdir(os.path.join(cg_dir, "resources", "enemys_textures"))
-            )
-            texture = np.asarray(
-                Image.open(os.path.join(cg_dir, "resources", "enemys_textures", image)),
-            )
-            self.game.scanline_with_texture(polygon=pol_aux1, texture=texture)
-            self.game.scanline_with_texture(polygon=pol_aux2, texture=texture)
+            fill = self.game.textures.get(random.choice(self.textures))
 
-        self.polygons.append(
-            [
-                pol,
-                polygon_type,
-                texture if polygon_type == "texture" else None,
-                color if polygon_type == "simple" else None,
-            ]
-        )
+        drawable = self.game.display_list.add(pol, fill)
 
-    def move_polygons(self):
-        polygons_list = self.polygons.copy()
+        self.polygons.append([pol, drawable])
+        self.grid.insert(drawable, pol.get_rectangle_bounds())
 
-        for i in range(len(self.polygons)):
-            polygon = self.polygons[i][0]
-            pol_type = self.polygons[i][1]
+    def move_polygons(self, ticks=1):
+        # A fraction or several ticks at once move the enemies as far as that
+        # many ticks would
+        self.last_fall = self.fall_distance * ticks
 
-            pol_aux1 = self.game.map_window(polygon, self.windows[0], self.viewports[0])
-            pol_aux2 = self.game.map_window(polygon, self.windows[1], self.viewports[1])
-            self.game.scanline_base(pol_aux1, Color((0, 0, 0)))
-            self.game.scanline_base(pol_aux2, Color((0, 0, 0)))
+        if len(self.polygons) == 0:
+            return
 
-            y_actual = polygon.points[2][1]
-            if y_actual >= self.viewports[0][3]:
-                polygons_list.remove(self.polygons[i])
+        polygons_list = []
+
+        for entry in self.polygons:
+            y_actual = entry[0].positions[2, 1]
+            if y_actual >= self.viewport.window[3]:
                 self.enemys_removed += 1
+                self.game.display_list.remove(entry[1])
+                self.grid.remove(entry[1])
                 continue
 
-            m1 = self.game.create_transformation_matrix()
-            m1 = self.game.compose_translation(m1, 0, 4)
+            polygons_list.append(entry)
 
-            polygon = self.game.apply_transformation(polygon, m1)
-            self.polygons[i][0] = polygon
+        self.polygons = polygons_list
 
-            pol_aux1 = self.game.map_window(polygon, self.windows[0], self.viewports[0])
-            pol_aux2 = self.game.map_window(polygon, self.windows[1], self.viewports[1])
+        if len(self.polygons) == 0:
+            return
 
-            if pol_type == "simple":
-                self.game.scanline_base(polygon=pol_aux1, color=self.polygons[i][3])
-                self.game.scanline_base(polygon=pol_aux2, color=self.polygons[i][3])
+        # Every enemy falls by the same offset, so they move as one batch
+        polygons = self.game.apply_transformation(
+            [polygon for polygon, _ in self.polygons],
+            Affine().translate(0, self.last_fall),
+        )
 
-            elif pol_type == "color_gradient":
-                self.game.scanline_with_color_gradient(polygon=pol_aux1)
-                self.game.scanline_with_color_gradient(polygon=pol_aux2)
+        for entry, polygon in zip(self.polygons, polygons):
+            entry[0] = polygon
+            self.game.display_list.move(entry[1], polygon)
+            self.grid.move(entry[1], polygon.get_rectangle_bounds())
 
-            else:
-                self.game.scanline_with_texture(
-                    polygon=pol_aux1, texture=self.polygons[i][2]
-                )
-                self.game.scanline_with_texture(
-                    polygon=pol_aux2, texture=self.polygons[i][2]
-                )
+    def check_for_colision(self, cat):
+        # Swept over the step since the last check, taking both motions as
+        # straight lines, so a coarse tick can't carry an enemy through the
+        # cat. The cat's motion comes from where it was at that check.
+        position = cat.cat_pol.positions[0].copy()
 
-        self.polygons = polygons_list
+        if self.cat_position is None:
+            self.cat_position = position
+
+        cat_x, cat_y = (position - self.cat_position).tolist()
+        motion = (-cat_x, self.last_fall - cat_y)
+
+        self.cat_position = position
+        self.last_fall = 0
+
+        # Only the enemies sharing a grid cell with the cat's swept bounds
+        # are tested
+        x1, y1, x2, y2 = cat.cat_pol.get_rectangle_bounds()
+        mx, my = motion
+
+        nearby = self.grid.query(
+            (x1 + min(mx, 0), y1 + min(my, 0), x2 + max(mx, 0), y2 + max(my, 0))
+        )
 
-    def check_for_colision(self, cat):
         return any(
-            cat.cat_pol.check_collision(polygon) for polygon, _, _, _ in self.polygons
+            cat.cat_pol.check_collision(drawable.polygon, motion) for drawable in nearby
         )
 
+    def _transform_polygon(self, pol_pos, m):
+        polygon = self.game.apply_transformation(self.polygons[pol_pos][0], m)
+
+        self.polygons[pol_pos][0] = polygon
+        self.game.display_list.move(self.polygons[pol_pos][1], polygon)
+        self.grid.move(self.polygons[pol_pos][1], polygon.get_rectangle_bounds())
+
     def rotate_polygon(self):
         if len(self.polygons) == 0:
             return
 
-        m = self.game.create_transformation_matrix()
-        m = self.game.compose_rotation(m, 5)
-        m = self.game.compose_translation(m, 20, 0)
+        m = Affine().rotate(5).translate(20, 0)
 
         pol_pos = random.randint(0, len(self.polygons) - 1)
 
-        if self.polygons[pol_pos][0].points[0][0] < 50:
+        if self.polygons[pol_pos][0].positions[0, 0] < 50:
             return
 
-        pol_aux1 = self.game.map_window(
-            self.polygons[pol_pos][0], self.windows[0], self.viewports[0]
-        )
-        pol_aux2 = self.game.map_window(
-            self.polygons[pol_pos][0], self.windows[1], self.viewports[1]
-        )
-        self.game.scanline_base(pol_aux1, Color((0, 0, 0)))
-        self.game.scanline_base(pol_aux2, Color((0, 0, 0)))
-
-        self.polygons[pol_pos][0] = self.game.apply_transformation(
-            self.polygons[pol_pos][0], m
-        )
-
-        pol_aux1 = self.game.map_window(
-            self.polygons[pol_pos][0], self.windows[0], self.viewports[0]
-        )
-        pol_aux2 = self.game.map_window(
-            self.polygons[pol_pos][0], self.windows[1], self.viewports[1]
-        )
-
-        if self.polygons[pol_pos][1] == "simple":
-            self.game.scanline_base(polygon=pol_aux1, color=self.polygons[pol_pos][3])
-            self.game.scanline_base(polygon=pol_aux2, color=self.polygons[pol_pos][3])
-
-        elif self.polygons[pol_pos][1] == "color_gradient":
-            self.game.scanline_with_color_gradient(polygon=pol_aux1)
-            self.game.scanline_with_color_gradient(polygon=pol_aux2)
-
-        else:
-            self.game.scanline_with_texture(
-                polygon=pol_aux1, texture=self.polygons[pol_pos][2]
-            )
-            self.game.scanline_with_texture(
-                polygon=pol_aux2, texture=self.polygons[pol_pos][2]
-            )
+        self._transform_polygon(pol_pos, m)
 
     def scale_polygon(self):
         if len(self.polygons) == 0:
@@ -999,50 +2182,17 @@ class EnemyPolygons:
 
         centerx, centery = polygon.center()
 
-        m = self.game.create_transformation_matrix()
-
-        m = self.game.compose_translation(m, -centerx, -centery)
-        m = self.game.compose_scale(m, 1.3, 1.3)
-        m = self.game.compose_translation(m, centerx, centery)
+        m = (
+            Affine()
+            .translate(-centerx, -centery)
+            .scale(1.3, 1.3)
+            .translate(centerx, centery)
+        )
 
         if (
-            self.polygons[pol_pos][0].points[0][0] < 50
-            or self.polygons[pol_pos][0].points[0][0] > 500
+            self.polygons[pol_pos][0].positions[0, 0] < 50
+            or self.polygons[pol_pos][0].positions[0, 0] > 500
         ):
             return
 
-        pol_aux1 = self.game.map_window(
-            self.polygons[pol_pos][0], self.windows[0], self.viewports[0]
-        )
-        pol_aux2 = self.game.map_window(
-            self.polygons[pol_pos][0], self.windows[1], self.viewports[1]
-        )
-        self.game.scanline_base(pol_aux1, Color((0, 0, 0)))
-        self.game.scanline_base(pol_aux2, Color((0, 0, 0)))
-
-        self.polygons[pol_pos][0] = self.game.apply_transformation(
-            self.polygons[pol_pos][0], m
-        )
-
-        pol_aux1 = self.game.map_window(
-            self.polygons[pol_pos][0], self.windows[0], self.viewports[0]
-        )
-        pol_aux2 = self.game.map_window(
-            self.polygons[pol_pos][0], self.windows[1], self.viewports[1]
-        )
-
-        if self.polygons[pol_pos][1] == "simple":
-            self.game.scanline_base(polygon=pol_aux1, color=self.polygons[pol_pos][3])
-            self.game.scanline_base(polygon=pol_aux2, color=self.polygons[pol_pos][3])
-
-        elif self.polygons[pol_pos][1] == "color_gradient":
-            self.game.scanline_with_color_gradient(polygon=pol_aux1)
-            self.game.scanline_with_color_gradient(polygon=pol_aux2)
-
-        else:
-            self.game.scanline_with_texture(
-                polygon=pol_aux1, texture=self.polygons[pol_pos][2]
-            )
-            self.game.scanline_with_texture(
-                polygon=pol_aux2, texture=self.polygons[pol_pos][2]
-            )
+        self._transform_polygon(pol_pos, m)
@@ -1,11 +1,18 @@
-import os
+import argparse
 import time
 
-import numpy as np
 import pygame
-from PIL import Image
 
-from cgpy import Cat, Color, Game, Polygon, TexturePolygon, EnemyPolygons
+from cgpy import (
+    Cat,
+    Color,
+    EnemyPolygons,
+    Game,
+    Minimap,
+    Polygon,
+    TexturePolygon,
+    Viewport,
+)
 
 clock = pygame.time.Clock()
 
@@ -21,11 +28,13 @@ red_pastel = Color((255, 150, 129))
 blank = Color((255, 255, 255))
 black = Color((0, 0, 0))
 
-cg_dir = os.getcwd()
-
 
 FPS = 45
 
+# Milliseconds between enemy moves. Enemies keep the same speed at any
+# interval and collisions are swept, so a slower rate never misses a hit.
+MOVE_INTERVAL = 40
+
 
 def home_screen(game):
     sky_falling_logo_pol = TexturePolygon(
@@ -37,46 +46,58 @@ def home_screen(game):
         ]
     )
 
-    sky_falling_logo_texture = np.asarray(
-        Image.open(os.path.join(cg_dir, "resources", "sky_falling_logo.png"))
-    )
+    sky_falling_logo_texture = game.textures.get("sky_falling_logo.png")
 
     game.scanline_with_texture(sky_falling_logo_pol, sky_falling_logo_texture)
 
-    game.line_bresenham(0, 145, 40, 195, blank)
     game.circumference(60, 195, 20, green_pastel1)
-    game.line_bresenham(80, 195, 120, 165, blank)
     game.ellipse(145, 165, 25, 40, purple_pastel)
-
-    game.line_bresenham(170, 165, 250, 215, blank)
-
-    # Rectangle
-    game.line_bresenham(250, 165, 250, 245, blue_pastel)
-    game.line_bresenham(250, 245, 300, 245, blue_pastel)
-    game.line_bresenham(300, 245, 300, 165, blue_pastel)
-    game.line_bresenham(300, 165, 250, 165, blue_pastel)
-
-    game.line_bresenham(300, 205, 350, 165, blank)
     game.circumference(375, 165, 25, red_pastel)
-    game.line_bresenham(400, 165, 440, 190, blank)
     game.circumference(460, 190, 20, green_pastel2)
-    game.line_bresenham(480, 190, 500, 195, blank)
 
-    pygame.display.update()
+    # Rectangle, then the lines "securing" the figures, drawn over it
+    game.draw_lines(
+        [
+            (250, 165, 250, 245),
+            (250, 245, 300, 245),
+            (300, 245, 300, 165),
+            (300, 165, 250, 165),
+            (0, 145, 40, 195),
+            (80, 195, 120, 165),
+            (170, 165, 250, 215),
+            (300, 205, 350, 165),
+            (400, 165, 440, 190),
+            (480, 190, 500, 195),
+        ],
+        [blue_pastel] * 4 + [blank] * 6,
+        method="bresenham",
+    )
 
-    game.flood_fill(60, 195, green_pastel1, animation=True)
-    game.check_for_quit()
+    game.update()
 
-    game.flood_fill(145, 165, purple_pastel, animation=True)
-    game.check_for_quit()
+    # Fill the figures one at a time
+    game.fill_circle(60, 195, 20, green_pastel1)
+    time.sleep(0.1)
+    game.update()
 
-    game.flood_fill(270, 175, blue_pastel, animation=True)
-    game.check_for_quit()
+    game.fill_ellipse(145, 165, 25, 40, purple_pastel)
+    time.sleep(0.1)
+    game.update()
 
-    game.flood_fill(375, 165, red_pastel, animation=True)
-    game.check_for_quit()
+    game.scanline_base(
+        Polygon([[250, 165], [250, 245], [300, 245], [300, 165]]), blue_pastel
+    )
+    time.sleep(0.1)
+    game.update()
+
+    game.fill_circle(375, 165, 25, red_pastel)
+    time.sleep(0.1)
+    game.update()
+
+    game.fill_circle(460, 190, 20, green_pastel2)
+    time.sleep(0.1)
+    game.update()
 
-    game.flood_fill(460, 190, green_pastel2, animation=True)
     game.check_for_quit()
 
     instructions_pol = TexturePolygon(
@@ -88,13 +109,11 @@ def home_screen(game):
         ]
     )
 
-    instructions_texture = np.asarray(
-        Image.open(os.path.join(cg_dir, "resources", "instructions.png"))
-    )
+    instructions_texture = game.textures.get("instructions.png")
 
     game.scanline_with_texture(instructions_pol, instructions_texture)
 
-    pygame.display.update()
+    game.update()
 
     running = True
 
@@ -106,21 +125,27 @@ def home_screen(game):
                 if event.key == pygame.K_RETURN:
                     print("Jogo iniciado!")
                     running = False
-                    pygame.display.update()
+                    game.update()
 
     # Remove lines "securing" the figures
-    game.line_bresenham(0, 145, 40, 195, black)
-    game.line_bresenham(80, 195, 120, 165, black)
-    game.line_bresenham(170, 165, 250, 215, black)
-    game.line_bresenham(300, 205, 350, 165, black)
-    game.line_bresenham(400, 165, 440, 190, black)
-    game.line_bresenham(480, 190, 500, 195, black)
+    game.draw_lines(
+        [
+            (0, 145, 40, 195),
+            (80, 195, 120, 165),
+            (170, 165, 250, 215),
+            (300, 205, 350, 165),
+            (400, 165, 440, 190),
+            (480, 190, 500, 195),
+        ],
+        black,
+        method="bresenham",
+    )
 
-    pygame.display.update()
+    game.update()
 
     time.sleep(0.5)
 
-    game.surface.fill((0, 0, 0))
+    game.fill(black)
     game.scanline_with_texture(sky_falling_logo_pol, sky_falling_logo_texture)
 
     # Setting all figures as polygons to apply transformations
@@ -134,9 +159,7 @@ def home_screen(game):
         ]
     )
 
-    circumference_green_1_tex = np.asarray(
-        Image.open(os.path.join(cg_dir, "resources", "green_1_circumference.png"))
-    )
+    circumference_green_1_tex = game.textures.get("green_1_circumference.png")
     game.scanline_with_texture(
         circumference_green_1_pol,
         circumference_green_1_tex,
@@ -151,9 +174,7 @@ def home_screen(game):
         ]
     )
 
-    purple_ellipse_1_tex = np.asarray(
-        Image.open(os.path.join(cg_dir, "resources", "purple_ellipse.png"))
-    )
+    purple_ellipse_1_tex = game.textures.get("purple_ellipse.png")
     game.scanline_with_texture(
         purple_ellipse_1_pol,
         purple_ellipse_1_tex,
@@ -168,9 +189,7 @@ def home_screen(game):
         ]
     )
 
-    red_circumference_tex = np.asarray(
-        Image.open(os.path.join(cg_dir, "resources", "red_circumference.png"))
-    )
+    red_circumference_tex = game.textures.get("red_circumference.png")
     game.scanline_with_texture(
         red_circumference_pol,
         red_circumference_tex,
@@ -185,9 +204,7 @@ def home_screen(game):
         ]
     )
 
-    green_2_circumference_tex = np.asarray(
-        Image.open(os.path.join(cg_dir, "resources", "green_2_circumference.png"))
-    )
+    green_2_circumference_tex = game.textures.get("green_2_circumference.png")
     game.scanline_with_texture(
         green_2_circumference_pol,
         green_2_circumference_tex,
@@ -203,7 +220,7 @@ def home_screen(game):
     )
     game.scanline_base(rectangle_pol, blue_pastel)
 
-    pygame.display.update()
+    game.update()
 
     m1 = game.create_transformation_matrix()
     m2 = game.create_transformation_matrix()
@@ -221,7 +238,7 @@ def home_screen(game):
 
     time.sleep(0.2)
 
-    pygame.display.update()
+    game.update()
 
     game.scanline_base(rectangle_pol, blue_pastel)
 
@@ -259,36 +276,43 @@ def home_screen(game):
 
         time.sleep(0.25)
 
-        pygame.display.update()
+        game.update()
 
     time.sleep(0.5)
-    game.surface.fill((0, 0, 0))
+    game.fill(black)
+
+    game.update()
 
-    pygame.display.update()
 
+def sky_falling_game(game, move_interval=MOVE_INTERVAL):
+    # Whatever is on screen now is what moving objects leave behind them
+    game.save_background()
 
-def sky_falling_game(game):
     viewport_game = [0, 0, 500, 550]
     window_game = [0, 0, 500, 550]
 
     viewport_mini_map = [450, 0, 500, 55]
     window_mini_map = [0, 0, 450, 550]
 
+    game_view = game.display_list.add_viewport(Viewport(window_game, viewport_game))
+
     cat = Cat(
         game=game,
-        windows=[window_game, window_mini_map],
-        viewports=[viewport_game, viewport_mini_map],
+        viewport=game_view,
         steps=8,
     )
 
+    # Enemies fall 4 px every 40 ms whatever the tick is
     enemy_polygons = EnemyPolygons(
         game=game,
-        windows=[window_game, window_mini_map],
-        viewports=[viewport_game, viewport_mini_map],
+        viewport=game_view,
+        fall_distance=4 * move_interval / 40,
     )
 
+    mini_map = Minimap(game, game_view, Viewport(window_mini_map, viewport_mini_map))
+
     ADD_POLYGON_INTERVAL = 3500
-    MOVE_POLYGON_INTERVAL = 40
+    MOVE_POLYGON_INTERVAL = move_interval
     ROTATE_POLYGON_INTERVAL = 4500
     SCALE_POLYGON_INTERVAL = 5500
 
@@ -341,8 +365,12 @@ def sky_falling_game(game):
 
             polygon_spawn_timer = current_time
 
-        if current_time - polygon_move_timer >= MOVE_POLYGON_INTERVAL:
-            enemy_polygons.move_polygons()
+        # A slow frame moves the enemies by all the ticks it took in one step.
+        # Collisions are swept, so they can't skip past the cat.
+        elapsed = current_time - polygon_move_timer
+
+        if elapsed >= MOVE_POLYGON_INTERVAL:
+            enemy_polygons.move_polygons(elapsed / MOVE_POLYGON_INTERVAL)
             if enemy_polygons.check_for_colision(cat):
                 break
 
@@ -356,13 +384,16 @@ def sky_falling_game(game):
             enemy_polygons.scale_polygon()
             polygon_scale_timer = current_time
 
+        game.display_list.render()
+        mini_map.render()
+
         clock.tick(FPS)
-        pygame.display.update()
+        game.update()
 
     points = enemy_polygons.enemys_removed
     print(f"{points} polígonos desviados!")
 
-    game.surface.fill((61, 63, 65))
+    game.fill(Color((61, 63, 65)))
     game_over_pol = TexturePolygon(
         [
             [0, 125, 0.05, 0],
@@ -372,14 +403,12 @@ def sky_falling_game(game):
         ]
     )
 
-    game_over_texture = np.asarray(
-        Image.open(os.path.join(cg_dir, "resources", "game_over.jpg"))
-    )
+    game_over_texture = game.textures.get("game_over.jpg")
 
     pol = game.map_window(game_over_pol, window_game, viewport_game)
     game.scanline_with_texture(pol, game_over_texture)
 
-    pygame.display.update()
+    game.update()
 
     while running:
         for event in pygame.event.get():
@@ -387,12 +416,23 @@ def sky_falling_game(game):
                 running = False
 
 
-def main():
-    game = Game(width=500, height=550)
+def main(move_interval=MOVE_INTERVAL, headless=False):
+    # Headless runs still wait on the keyboard, so they are meant for harnesses
+    # that post their own events
+    game = Game(width=500, height=550, framebuffer=True, headless=headless)
 
     home_screen(game)
-    sky_falling_game(game)
+    sky_falling_game(game, move_interval=move_interval)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--move-interval",
+        type=int,
+        default=MOVE_INTERVAL,
+        help="milliseconds between enemy moves, raise it on slow machines",
+    )
+    args = parser.parse_args()
+
+    main(move_interval=args.move_interval)